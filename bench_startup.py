@@ -0,0 +1,90 @@
+"""Cold-start benchmark of `import client_obj`.
+
+Imports the module in fresh interpreters, from an empty working directory,
+and reports the median wall time and the slowest imports (-X importtime).
+Fails (exit 1) when the import pulls in a heavy module, leaves files behind,
+or, with --max-ms, is slower than the budget.
+
+    python bench_startup.py --runs 20 --max-ms 150
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+HERE: str = os.path.dirname(os.path.abspath(__file__))
+# only needed once a server is started, or for the `ipy` command
+HEAVY_MODULES: list[str] = ["IPython", "pydantic", "pylspclient"]
+
+PROBE: str = """
+import sys, time
+t = time.perf_counter()
+import client_obj
+t = time.perf_counter() - t
+heavy = [m for m in %r if m in sys.modules]
+print(f"{t * 1000}|{','.join(heavy)}")
+""" % (
+    HEAVY_MODULES,
+)
+
+
+def run_once(cwd: str, importtime: bool = False) -> tuple[float, list[str], str]:
+    env = dict(os.environ, PYTHONPATH=HERE)
+    flags = ["-X", "importtime"] if importtime else []
+    cmd = [sys.executable, *flags, "-c", PROBE]
+    proc = subprocess.run(cmd, cwd=cwd, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import failed:\n{proc.stderr}")
+    ms, heavy = proc.stdout.strip().splitlines()[-1].split("|")
+    return float(ms), [m for m in heavy.split(",") if m], proc.stderr
+
+
+def slowest_imports(importtime_log: str, n: int) -> list[tuple[int, str]]:
+    entries = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if cumulative.strip().isdigit():
+            entries.append((int(cumulative), name.rstrip()))
+    return sorted(entries, reverse=True)[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, default=None)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as cwd:
+        times = []
+        for _ in range(args.runs):
+            ms, heavy, _ = run_once(cwd)
+            times.append(ms)
+        _, _, log = run_once(cwd, importtime=True)
+        leftovers = os.listdir(cwd)
+
+    median = statistics.median(times)
+    print(f"import client_obj: median {median:.1f}ms, min {min(times):.1f}ms")
+    print("slowest imports (cumulative us):")
+    for us, name in slowest_imports(log, args.top):
+        print(f"  {us:>8} {name}")
+
+    if heavy:
+        failures.append(f"heavy modules imported: {heavy}")
+    if leftovers:
+        failures.append(f"import created files: {leftovers}")
+    if args.max_ms is not None and median > args.max_ms:
+        failures.append(f"median {median:.1f}ms > {args.max_ms}ms")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
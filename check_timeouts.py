@@ -0,0 +1,62 @@
+"""Regression check: a request timing out must not break the next ones.
+
+Starts pygls_synth with a latency above lsp_timeout, lets a definition
+request time out, waits for its late response, then repeats the request with
+a longer timeout. Fails (exit 1) when the late response killed the endpoint's
+reader thread or was left behind in its response_dict.
+
+    python check_timeouts.py --latency 1.5 --timeout 1
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from client_obj import PyLspClient
+
+HERE: str = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=1.5)
+    parser.add_argument("--timeout", type=float, default=1.0)
+    args = parser.parse_args()
+
+    client = PyLspClient(
+        initfile=os.path.join(HERE, "testdata/python3/main.py"),
+        server="synthetic",
+        server_args=f"--latency {args.latency}",
+        lsp_timeout=args.timeout,
+        post_init_wait=0,
+    )
+    client.init()
+    failures = []
+    try:
+        try:
+            client.generic_textdoc("definition", pos=(0, 0))
+            failures.append("first request did not time out")
+        except TimeoutError:
+            pass
+        time.sleep(args.latency - args.timeout + 0.5)
+        endpoint = client.lsp_endpoint
+        if not endpoint.is_alive():
+            failures.append("reader thread died on the late response")
+        if endpoint.response_dict:
+            failures.append(f"late responses kept: {list(endpoint.response_dict)}")
+        endpoint._timeout = args.latency + 2
+        try:
+            res = client.generic_textdoc("definition", pos=(1, 0))
+            print(f"second request: {res}")
+        except TimeoutError:
+            failures.append("second request timed out")
+    finally:
+        client.shutdown()
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,67 @@
+import glob
+import json
 import logging
 import os.path
+import select
+import shlex
 import subprocess
 import sys
 import time
 from pprint import pformat, pprint
 import traceback
-from typing import Any, Optional
+from contextlib import contextmanager
+from typing import Any, Iterable, Optional, Sequence
 
 import threading
-from pylspclient.lsp_errors import ErrorCodes, ResponseError
-
-import IPython
-import pylspclient  # type: ignore
-from pylspclient.lsp_pydantic_strcuts import (  # type: ignore
-    LanguageIdentifier,
-    TextDocumentIdentifier,
-    TextDocumentItem,
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+# pylspclient (and with it pydantic) and IPython are imported where used, so
+# that importing this module stays cheap and free of side effects
+from profiling import SessionProfiler, maybe_span
+from typed_results import to_typed
+from utils import (
+    FILE_DELETED,
+    SERVER_RESTARTED,
+    SOURCE_SUFFIXES,
+    MemoryCacher,
+    SingleFlight,
+    annotate,
+    dump_semantic_tokens_full,
+    invalidate_file,
+    readfile_whole,
+    to_uri,
 )
 
-from utils import annotate, dump_semantic_tokens_full, readfile_whole, to_uri
-
-os.makedirs("logs", exist_ok=True)
 CompatLogFormat: str = "%(asctime)s - %(levelname)s - %(message)s"
 VerboseLogFormat: str = (
     "\n%(asctime)s - %(levelname)s - %(pathname)s:%(lineno)d in %(funcName)s\n%(message)s"
 )
-file_handler = logging.FileHandler("logs/lsp_notifications.log")
-file_handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter(VerboseLogFormat)
-file_handler.setFormatter(formatter)
+NotificationLogfile: str = "logs/lsp_notifications.log"
+
+
+def _add_file_handler(logger: logging.Logger, logfile: str):
+    """Log to `logfile`, once per logger however many clients are created"""
+    path = os.path.abspath(logfile)
+    for handler in logger.handlers:
+        if isinstance(handler, logging.FileHandler) and handler.baseFilename == path:
+            return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    file_handler = logging.FileHandler(path)
+    file_handler.setLevel(logging.DEBUG)
+    formatter = logging.Formatter(VerboseLogFormat)
+    file_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+
+
 _notification_logger = logging.getLogger("LspNotification")
-_notification_logger.setLevel(logging.INFO)
-_notification_logger.addHandler(file_handler)
 
 
 def _log_notification(name):
+    _notification_logger.setLevel(logging.INFO)
+    _add_file_handler(_notification_logger, NotificationLogfile)
+
     def f(*args, **kwargs):
         _notification_logger.info(f"{name}: args={args}")
         _notification_logger.info(f"{name}: kwargs={kwargs}")
@@ -43,7 +70,16 @@ def _log_notification(name):
 
 
 IntPair = tuple[int, int]
+# a TextDocumentIdentifier, as sent to the server
+DocId = dict[str, str]
+# textDocument methods answering Location | Location[] | LocationLink[]
+LOCATION_METHODS: frozenset[str] = frozenset(
+    {"definition", "declaration", "typeDefinition", "implementation", "references"}
+)
 
+SYNTHETIC_SERVER: str = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "pygls_synth"
+)
 
 def flatten_symbols(symbols, parent_name=""):
     """Flatten symbols from hierarchicalDocumentSymbolSupport"""
@@ -61,6 +97,8 @@ def flatten_symbols(symbols, parent_name=""):
 
 class PyLspClient:
     def _infer_language_id(self, initfile: str, workspace: str):
+        from pylspclient.lsp_pydantic_strcuts import LanguageIdentifier  # type: ignore
+
         if initfile is not None:
             initfile_suffix = {
                 ".py": LanguageIdentifier.PYTHON,
@@ -83,6 +121,8 @@ class PyLspClient:
         return None
 
     def _infer_workspace(self, initfile: str):
+        from pylspclient.lsp_pydantic_strcuts import LanguageIdentifier  # type: ignore
+
         if initfile is None:
             return None
         match self.language_id:
@@ -105,6 +145,10 @@ class PyLspClient:
         logfile="logs/lsp.log",
         verbose=False,
         cacher: Optional[Any] = None,
+        prefetch: Optional[Sequence[str]] = None,
+        server: Optional[str] = None,
+        server_args: str = "",
+        typed_results: bool = False,
     ):
         assert (initfile or workspace) is not None
         self.post_init_wait = post_init_wait
@@ -112,20 +156,54 @@ class PyLspClient:
         self.initfile = initfile
         self.workspace = workspace or self._infer_workspace(initfile)
         self.lsp_timeout = lsp_timeout
-        self.opened_docs: dict[str, TextDocumentIdentifier] = {}
+        # "synthetic" selects pygls_synth, configured by server_args
+        self.server = server
+        self.server_args = server_args
+        self.opened_docs: dict[str, DocId] = {}
+        self.doc_versions: dict[str, int] = {}
         self.cacher = cacher
-
-        file_handler = logging.FileHandler(logfile)
-        file_handler.setLevel(logging.DEBUG)
-        formatter = logging.Formatter(VerboseLogFormat)
-        file_handler.setFormatter(formatter)
+        # convert Location results to typed_results.LocationList
+        self.typed_results = typed_results
+        # cacher keys of generic_textdoc results, by the file they were asked
+        # on, guarded by _open_lock
+        self._cache_keys: dict[str, set[str]] = {}
+        # invalidations per file, a response to a request sent before one
+        # is not cached. Guarded by _open_lock
+        self._invalidations: dict[str, int] = {}
+        self.supervisor = None
+        self.watcher = None
+        self.profiler: Optional[SessionProfiler] = None
+        self.prefetcher = None
+        if prefetch:
+            from prefetch import Prefetcher
+
+            self.cacher = self.cacher or MemoryCacher()
+            self.prefetcher = Prefetcher(self, prefetch)
+        self._open_lock = threading.RLock()
+        # identical generic_textdoc requests in flight share one server request
+        self._flights = SingleFlight()
+        # number of foreground requests in flight, prefetching waits for zero
+        self._foreground_count = 0
+        self._idle = threading.Condition()
+        # cleared while restart_lsp runs, requests wait on it. Set from the
+        # start, so that the init steps can also be called one by one
+        self._ready = threading.Event()
+        self._ready.set()
+        self._generation = 0
+        self._restart_lock = threading.Lock()
 
         self.logger = logging.getLogger("PyLspClient")
         log_level = logging.DEBUG if verbose else logging.INFO
         self.logger.setLevel(log_level)
-        self.logger.addHandler(file_handler)
+        _add_file_handler(self.logger, logfile)
 
     def shutdown(self):
+        if self.supervisor is not None:
+            self.supervisor.stop()
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+        if self.watcher is not None:
+            self.watcher.stop()
         self.lspcli.shutdown()
         self.lspcli.exit()
         self.srvproc.kill()
@@ -136,6 +214,15 @@ class PyLspClient:
             print("Finish: LSP process stderr:\n", stderr.decode())
 
     def compute_lspcmdlist(self):
+        if self.server == "synthetic":
+            self.lsp_cmdlist = [
+                sys.executable,
+                SYNTHETIC_SERVER,
+                *shlex.split(self.server_args),
+            ]
+            return
+        from pylspclient.lsp_pydantic_strcuts import LanguageIdentifier  # type: ignore
+
         match self.language_id:
             case LanguageIdentifier.C:
                 self.lsp_cmdlist = [
@@ -157,6 +244,10 @@ class PyLspClient:
                 raise ValueError("Invalid language argument")
 
     def initialize_lsp(self):
+        import pylspclient  # type: ignore
+
+        from endpoint import ThreadSafeLspEndpoint
+
         try:
             self.srvproc = subprocess.Popen(
                 self.lsp_cmdlist,
@@ -167,11 +258,11 @@ class PyLspClient:
         except FileNotFoundError as e:
             print(f"The language server {self.lsp_cmdlist} is not found")
             print(f"Did you install it? Did you do `conda activate ...`?")
-            exit(1)
+            raise
         self.json_rpc = pylspclient.JsonRpcEndpoint(
             self.srvproc.stdin, self.srvproc.stdout
         )
-        self.lsp_endpoint = pylspclient.LspEndpoint(
+        self.lsp_endpoint = ThreadSafeLspEndpoint(
             self.json_rpc,
             notify_callbacks={
                 "window/logMessage": _log_notification("windowLogMessage"),
@@ -241,51 +332,434 @@ class PyLspClient:
         self.compute_lspcmdlist()
         self.initialize_lsp()
         self.post_initialize_lsp()
+        if self.prefetcher is not None:
+            self.prefetcher.start()
+
+    def supervise(self, **kwargs):
+        """Start a LspSupervisor on this client, see lsp_supervisor.py for kwargs"""
+        from lsp_supervisor import LspSupervisor
+
+        if self.supervisor is not None:
+            self.supervisor.stop()
+        self.supervisor = LspSupervisor(self, **kwargs)
+        self.supervisor.start()
+        return self.supervisor
+
+    def watch(self, **kwargs):
+        """Start a WorkspaceWatcher on this client, see watcher.py for kwargs"""
+        from watcher import WorkspaceWatcher
+
+        if self.watcher is not None:
+            self.watcher.stop()
+        self.watcher = WorkspaceWatcher(self, **kwargs)
+        self.watcher.start()
+        return self.watcher
+
+    def start_profile(self, **kwargs) -> SessionProfiler:
+        """Profile the following calls until stop_profile, see profiling.py"""
+        if self.profiler is not None:
+            self.profiler.stop()
+        self.profiler = SessionProfiler(**kwargs)
+        self.profiler.start()
+        return self.profiler
+
+    def stop_profile(self, outdir: Optional[str] = None) -> dict[str, Any]:
+        """Stop profiling, write the results to `outdir` and return the
+        per-span breakdown"""
+        profiler, self.profiler = self.profiler, None
+        if profiler is None:
+            raise ValueError("not profiling")
+        profiler.stop()
+        outdir = outdir or time.strftime("logs/profile-%Y%m%d-%H%M%S")
+        print(profiler.format_breakdown())
+        return profiler.write(outdir)
+
+    @contextmanager
+    def profile(self, outdir: Optional[str] = None, **kwargs):
+        self.start_profile(**kwargs)
+        try:
+            yield
+        finally:
+            self.stop_profile(outdir)
+
+    def restart_lsp(self, reason: str = ""):
+        """Kill the server, start a fresh one and replay the opened documents.
+
+        Requests issued meanwhile block until the new server is initialized,
+        requests stranded on the old server fail with SERVER_RESTARTED and are
+        retried by call_method.
+        """
+        with self._restart_lock:
+            self.logger.warning(f"restarting LSP server: {reason}")
+            self._ready.clear()
+            old_endpoint, old_proc = self.lsp_endpoint, self.srvproc
+            old_endpoint.stop()
+            old_proc.kill()
+            try:
+                old_proc.communicate(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.logger.warning(f"old server {old_proc.pid} did not exit")
+            error = {"code": SERVER_RESTARTED, "message": f"server restarted: {reason}"}
+            for rpc_id, cond in list(old_endpoint.event_dict.items()):
+                # not handle_result: a request that died on a broken pipe never
+                # releases its condition
+                old_endpoint.response_dict[rpc_id] = (None, error)
+                if cond.acquire(timeout=0.1):
+                    cond.notify()
+                    cond.release()
+            self._generation += 1
+            try:
+                self.initialize_lsp()
+                self.post_initialize_lsp()
+                for filepath in list(self.opened_docs):
+                    self._send_did_open(filepath)
+            except Exception as e:
+                # leave a dead server behind, so that the supervisor retries
+                # and requests fail fast instead of waiting on a broken one
+                self.logger.error(f"failed to restart LSP server: {e!r}")
+                if self.srvproc is not old_proc:
+                    # not lsp_endpoint.stop(): a stopped endpoint answers None
+                    self.srvproc.kill()
+                raise
+            finally:
+                self._ready.set()
+            self.logger.warning(
+                f"LSP server restarted, replayed {len(self.opened_docs)} documents"
+            )
 
-    def open_docfile(self, filepath: str) -> tuple[TextDocumentIdentifier, str]:
-        print(f"open_docfile {filepath=}")
-        if filepath in self.opened_docs:
-            return self.opened_docs[filepath], readfile_whole(filepath)
+    def call_method(self, method: str, **kwargs):
+        """call_method that waits out server restarts and retries once after one"""
+        from pylspclient.lsp_errors import ResponseError
+
+        for attempt in range(2):
+            self._wait_ready()
+            generation = self._generation
+            try:
+                with maybe_span(self.profiler, method, wait=True):
+                    return self.lsp_endpoint.call_method(method, **kwargs)
+            except (ResponseError, TimeoutError, BrokenPipeError) as e:
+                if isinstance(e, ResponseError) and e.code != SERVER_RESTARTED:
+                    raise
+                wait = self._restart_wait() if isinstance(e, BrokenPipeError) else 0.0
+                if attempt > 0 or not self._restarted_since(generation, wait):
+                    raise
+                self.logger.info(f"{method}: retrying after server restart")
+
+    def _wait_ready(self):
+        # a restart waits up to 5s for the old server, then initializes anew
+        timeout = 5 + 2 * self.lsp_timeout + self.post_init_wait
+        if not self._ready.wait(timeout):
+            raise TimeoutError(f"LSP server not ready after {timeout}s")
+
+    def _restart_wait(self) -> float:
+        # a dead pipe means the server crashed, give the supervisor a chance
+        return 0.0 if self.supervisor is None else 2 * self.supervisor.interval
+
+    def _restarted_since(self, generation: int, wait: float = 0.0) -> bool:
+        deadline = time.monotonic() + wait
+        while generation == self._generation and self._ready.is_set():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    @contextmanager
+    def _foreground(self):
+        with self._idle:
+            self._foreground_count += 1
+        try:
+            yield
+        finally:
+            with self._idle:
+                self._foreground_count -= 1
+                if self._foreground_count == 0:
+                    self._idle.notify_all()
+
+    def wait_foreground_idle(self, timeout: Optional[float] = None) -> bool:
+        with self._idle:
+            return self._idle.wait_for(
+                lambda: self._foreground_count == 0, timeout=timeout
+            )
+
+    def prefetch(self, filepaths: Iterable[str]):
+        """Hint that `filepaths` are about to be queried, e.g. by a crawler"""
+        if self.prefetcher is None:
+            return
+        for filepath in filepaths:
+            self.prefetcher.enqueue(self._resolve_path(filepath))
+
+    def _resolve_path(self, filepath: Optional[str]) -> str:
+        filepath = filepath or self.initfile
         if not os.path.isabs(filepath):
-            filepath = os.path.join(self.workspace, filepath)
+            filepath = os.path.abspath(os.path.join(self.workspace, filepath))
+        return filepath
+
+    def open_docfile(self, filepath: str) -> tuple[DocId, str]:
+        print(f"open_docfile {filepath=}")
+        self._wait_ready()
+        filepath = self._resolve_path(filepath)
+        with self._open_lock:
+            if filepath in self.opened_docs:
+                return self.opened_docs[filepath], readfile_whole(filepath)
+            generation = self._generation
+            try:
+                doc = self._send_did_open(filepath)
+            except BrokenPipeError:
+                if not self._restarted_since(generation, self._restart_wait()):
+                    raise
+                self._wait_ready()
+                doc = self._send_did_open(filepath)
+            self.opened_docs[filepath] = doc
+        if self.prefetcher is not None:
+            self.prefetcher.enqueue(filepath)
+        return doc, readfile_whole(filepath)
+
+    def _send_did_open(self, filepath: str) -> DocId:
         uri = to_uri(filepath)
         text = readfile_whole(filepath)
         version = 1
-        doc1 = TextDocumentItem(
-            uri=uri, languageId=self.language_id, version=version, text=text
+        self.doc_versions[filepath] = version
+        # plain dicts, building the pydantic structs costs more than sending
+        self.lsp_endpoint.send_notification(
+            "textDocument/didOpen",
+            textDocument={
+                "uri": uri,
+                "languageId": self.language_id,
+                "version": version,
+                "text": text,
+            },
+        )
+        return {"uri": uri}
+
+    def open_workspace(
+        self,
+        globs: Optional[Sequence[str]] = None,
+        max_inflight: int = 64,
+        workers: Optional[int] = None,
+    ) -> dict[str, float]:
+        """didOpen every file of the workspace matching `globs`, by default
+        the source files of the language (SOURCE_SUFFIXES).
+
+        Files are read and encoded on a thread pool while the calling thread
+        streams the didOpen notifications to the server. At most
+        `max_inflight` encoded notifications wait to be written, and each
+        write waits for the pipe to the server to be writable, so a server
+        that falls behind slows down the readers instead of piling up memory.
+        Files that are not UTF-8 are skipped. Returns throughput statistics.
+        """
+        if globs is None:
+            if self.language_id not in SOURCE_SUFFIXES:
+                raise ValueError(f"no default globs for {self.language_id}")
+            globs = [f"**/*{suffix}" for suffix in SOURCE_SUFFIXES[self.language_id]]
+        self._wait_ready()
+        matched = {
+            self._resolve_path(p)
+            for g in globs
+            for p in glob.glob(g, root_dir=self.workspace, recursive=True)
+        }
+        paths = sorted(
+            p for p in matched if os.path.isfile(p) and p not in self.opened_docs
+        )
+
+        def encode(path: str) -> tuple[str, Optional[bytes]]:
+            # not readfile_whole, which would keep every file in memory
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    text = f.read()
+            except UnicodeDecodeError as e:
+                self.logger.warning(f"open_workspace: skipping {path}: {e}")
+                return path, None
+            params = {
+                "textDocument": {
+                    "uri": to_uri(path),
+                    "languageId": self.language_id,
+                    "version": 1,
+                    "text": text,
+                }
+            }
+            body = json.dumps(
+                {"jsonrpc": "2.0", "method": "textDocument/didOpen", "params": params}
+            ).encode()
+            return path, b"Content-Length: %d\r\n\r\n" % len(body) + body
+
+        start = time.monotonic()
+        nfiles, nbytes, stall, skipped = 0, 0, 0.0, 0
+        todo = iter(paths)
+        with ThreadPoolExecutor(workers) as pool:
+            window = deque(pool.submit(encode, p) for p in islice(todo, max_inflight))
+            while window:
+                path, payload = window.popleft().result()
+                if payload is None:
+                    skipped += 1
+                else:
+                    # open_docfile may have opened it meanwhile, a second
+                    # didOpen of the same uri is a protocol error
+                    with self._open_lock:
+                        sent = path not in self.opened_docs
+                        if sent:
+                            stall += self._write_payload(payload)
+                            self.opened_docs[path] = {"uri": to_uri(path)}
+                            self.doc_versions[path] = 1
+                    if sent:
+                        nfiles += 1
+                        nbytes += len(payload)
+                        if self.prefetcher is not None:
+                            self.prefetcher.enqueue(path)
+                if (next_path := next(todo, None)) is not None:
+                    window.append(pool.submit(encode, next_path))
+        seconds = max(time.monotonic() - start, 1e-9)
+        stats = {
+            "files": nfiles,
+            "skipped": skipped,
+            "bytes": nbytes,
+            "seconds": seconds,
+            "files_per_s": nfiles / seconds,
+            "bytes_per_s": nbytes / seconds,
+            "stall_seconds": stall,
+        }
+        print(
+            f"open_workspace: {nfiles} files ({skipped} skipped), "
+            f"{nbytes / (1 << 20):.1f}MB in {seconds:.2f}s "
+            f"({stats['files_per_s']:.0f} files/s, "
+            f"{stats['bytes_per_s'] / (1 << 20):.1f}MB/s, stalled {stall:.2f}s)"
         )
-        self.lspcli.didOpen(doc1)
-        doc = TextDocumentIdentifier(uri=uri).model_dump()
-        assert doc is not None
-        self.opened_docs[filepath] = doc
-        return doc, text
+        self.logger.info(f"open_workspace: {stats}")
+        return stats
+
+    def _write_payload(self, payload: bytes) -> float:
+        """Write an already framed message as the server pipe drains,
+        returns the time spent waiting for it.
+
+        The pipe is switched to non-blocking while writing, so a message
+        larger than the free pipe space is written in chunks, each waiting
+        for writability, instead of blocking in one uncounted write.
+        """
+        stdin = self.srvproc.stdin
+        if stdin.closed:
+            raise BrokenPipeError("pipe to the server is closed")
+        fd = stdin.fileno()
+        view = memoryview(payload)
+        waited = 0.0
+        with self.json_rpc.write_lock:
+            stdin.flush()
+            os.set_blocking(fd, False)
+            try:
+                while view:
+                    t = time.monotonic()
+                    _, writable, _ = select.select([], [fd], [], self.lsp_timeout)
+                    stalled = time.monotonic() - t
+                    waited += stalled
+                    if not writable:
+                        if self.srvproc.poll() is not None:
+                            raise BrokenPipeError(
+                                f"server exited with {self.srvproc.returncode}"
+                            )
+                        self.logger.warning(
+                            f"server pipe not writable for {stalled:.1f}s"
+                        )
+                        continue
+                    try:
+                        view = view[os.write(fd, view) :]
+                    except BlockingIOError:
+                        continue
+            finally:
+                os.set_blocking(fd, True)
+        return waited
+
+    def did_change(self, filepath: str):
+        """Send the whole current contents of an opened document"""
+        filepath = self._resolve_path(filepath)
+        with self._open_lock:
+            if filepath not in self.opened_docs:
+                return
+            version = self.doc_versions.get(filepath, 1) + 1
+            self.doc_versions[filepath] = version
+            self.lsp_endpoint.send_notification(
+                "textDocument/didChange",
+                textDocument={"uri": to_uri(filepath), "version": version},
+                contentChanges=[{"text": readfile_whole(filepath)}],
+            )
+
+    def did_close(self, filepath: str):
+        filepath = self._resolve_path(filepath)
+        with self._open_lock:
+            doc = self.opened_docs.pop(filepath, None)
+            self.doc_versions.pop(filepath, None)
+            if doc is not None:
+                self.lsp_endpoint.send_notification(
+                    "textDocument/didClose", textDocument=doc
+                )
+
+    def invalidate(self, filepath: str):
+        """Forget the cached contents and responses of `filepath`"""
+        filepath = self._resolve_path(filepath)
+        invalidate_file(filepath)
+        # workers add keys concurrently, take them out under the lock
+        with self._open_lock:
+            self._invalidations[filepath] = self._invalidations.get(filepath, 0) + 1
+            keys = list(self._cache_keys.pop(filepath, ()))
+        if self.cacher:
+            for key in keys:
+                if hasattr(self.cacher, "delete"):
+                    self.cacher.delete(key)
+                else:
+                    # a None entry is a cache miss for generic_textdoc
+                    self.cacher.set(key, None)
+
+    def files_changed(self, changes: list[tuple[str, int]]):
+        """Propagate (filepath, FILE_CREATED/CHANGED/DELETED) changes to the
+        caches and to the server"""
+        if not changes:
+            return
+        self._wait_ready()
+        self.lsp_endpoint.send_notification(
+            "workspace/didChangeWatchedFiles",
+            changes=[{"uri": to_uri(path), "type": kind} for path, kind in changes],
+        )
+        for path, kind in changes:
+            path = self._resolve_path(path)
+            self.invalidate(path)
+            if path not in self.opened_docs:
+                continue
+            if kind == FILE_DELETED:
+                self.did_close(path)
+            else:
+                self.did_change(path)
+                if self.prefetcher is not None:
+                    self.prefetcher.enqueue(path, force=True)
 
     def semantic_tokens(self, filepath: Optional[str] = None) -> dict[str, Any]:
         print("self.initfile", self.initfile)
-        filepath = filepath or self.initfile
+        filepath = self._resolve_path(filepath)
         print(f"{filepath=}")
-        doc, text = self.open_docfile(filepath)
-        print(f"{doc=}")
-        res = self.lsp_endpoint.call_method(
-            "textDocument/semanticTokens/full", textDocument=doc
-        )
+        with self._foreground():
+            doc, text = self.open_docfile(filepath)
+            print(f"{doc=}")
+            res = self._textdoc_request("semanticTokens/full", filepath)
         tokens = res["data"]
-        annots = dump_semantic_tokens_full(
-            tokens, self.token_types, self.token_modifiers, text.splitlines()
-        )
-        print(annotate(text, annots))
+        with maybe_span(self.profiler, "dump_semantic_tokens_full"):
+            annots = dump_semantic_tokens_full(
+                tokens, self.token_types, self.token_modifiers, text.splitlines()
+            )
+        with maybe_span(self.profiler, "annotate"):
+            annotated = annotate(text, annots)
+        with maybe_span(self.profiler, "print"):
+            print(annotated)
         return res
 
     def generic(self, method: str, **kwargs):
         print(method, kwargs)
-        res = self.lsp_endpoint.call_method(f"{method}", **kwargs)
-        self.logger.debug(f"{method}:\n" + pformat(res, 4))
+        with self._foreground(), maybe_span(self.profiler, method):
+            res = self.call_method(f"{method}", **kwargs)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"{method}:\n" + pformat(res, 4))
         return res
 
     def generic_notification(self, method: str, **kwargs):
         print("notification ", method, kwargs)
         res = self.lsp_endpoint.send_notification(f"{method}", **kwargs)
-        self.logger.debug(f"notification {method}:\n" + pformat(res, 4))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"notification {method}:\n" + pformat(res, 4))
         return res
 
     def generic_textdoc(
@@ -295,10 +769,39 @@ class PyLspClient:
         pos: Optional[IntPair] = None,
         range: Optional[tuple[IntPair, IntPair]] = None,
     ):
-        key = f"{method=}:{filepath=}:{pos=}:{range=}"
+        filepath = self._resolve_path(filepath)
+        with self._foreground():
+            return self._textdoc_request(method, filepath, pos, range)
+
+    def _textdoc_request(
+        self,
+        method: str,
+        filepath: str,
+        pos: Optional[IntPair] = None,
+        range: Optional[tuple[IntPair, IntPair]] = None,
+    ):
+        typed = self.typed_results and method in LOCATION_METHODS
+        key = self.cache_key(method, filepath, pos, range, typed)
+        with maybe_span(self.profiler, f"textDocument/{method}"):
+            if self.cacher and (cached := self.cacher.get(key)) is not None:
+                return cached
+            return self._flights.do(
+                key, lambda: self._fetch_textdoc(key, method, filepath, pos, range)
+            )
+
+    def _fetch_textdoc(
+        self,
+        key: str,
+        method: str,
+        filepath: str,
+        pos: Optional[IntPair],
+        range: Optional[tuple[IntPair, IntPair]],
+    ):
+        # a flight for the same key may have completed since our cache lookup
         if self.cacher and (cached := self.cacher.get(key)) is not None:
             return cached
-        filepath = filepath or self.initfile
+        with self._open_lock:
+            invalidations = self._invalidations.get(filepath, 0)
         doc, _ = self.open_docfile(filepath)
         kwargs: dict[str, Any] = {}
         if pos is not None:
@@ -308,14 +811,36 @@ class PyLspClient:
                 "start": {"line": range[0][0], "character": range[0][1]},
                 "end": {"line": range[1][0], "character": range[1][1]},
             }
-        res = self.lsp_endpoint.call_method(
-            f"textDocument/{method}", textDocument=doc, **kwargs
-        )
+        if method == "references":
+            # ReferenceParams.context is mandatory
+            kwargs["context"] = {"includeDeclaration": True}
+        res = self.call_method(f"textDocument/{method}", textDocument=doc, **kwargs)
+        if self.typed_results and method in LOCATION_METHODS:
+            res = to_typed(res)
         if self.cacher:
-            self.cacher.set(key, res)
-        self.logger.debug(f"{method}: RETURNED {type(res)}:\n" + pformat(res, 4))
+            with self._open_lock:
+                # the file changed while the server was answering
+                if self._invalidations.get(filepath, 0) == invalidations:
+                    self.cacher.set(key, res)
+                    self._cache_keys.setdefault(filepath, set()).add(key)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            # pformat of a large result costs seconds, skip it unless verbose
+            self.logger.debug(f"{method}: RETURNED {type(res)}:\n" + pformat(res, 4))
         return res
 
+    @staticmethod
+    def cache_key(
+        method: str,
+        filepath: str,
+        pos: Optional[IntPair] = None,
+        range: Optional[tuple[IntPair, IntPair]] = None,
+        typed: bool = False,
+    ) -> str:
+        # typed results are cached apart, a cacher may be shared with
+        # clients without typed_results
+        key = f"{method=}:{filepath=}:{pos=}:{range=}"
+        return key + ":typed" if typed else key
+
 
 def eval_inputkwargs(args: str) -> dict[str, Any]:
     retval = {}
@@ -374,7 +899,7 @@ def main(inputer=input):
             persistent_kwargs = {}
             while True:
                 print(f"persisted: {persistent_kwargs}")
-                print("Methods: q , set , semtoks , _")
+                print("Methods: q , set , semtoks , profile , _")
                 cmdline = inputer("Method:args >> ")
                 if not cmdline.strip():
                     continue
@@ -388,12 +913,21 @@ def main(inputer=input):
                             persistent_kwargs.update(temp_kwargs)
                             continue
                         case "ckres" | "ipy":
+                            import IPython
+
                             IPython.embed(
                                 header="See last result in `res`, or operate with `client`"
                             )
                         case "reset":
                             persistent_kwargs = {}
                             continue
+                        case "profile":
+                            # toggles, `profile outdir=...` when stopping
+                            if client.profiler is None:
+                                client.start_profile()
+                                print("Profiling, `profile` again to stop")
+                                continue
+                            res = client.stop_profile(**temp_kwargs)
                         case "semtoks":
                             res = client.semantic_tokens(
                                 **(persistent_kwargs | temp_kwargs)
@@ -421,24 +955,25 @@ def main(inputer=input):
             exit(0)
 
 
-try:
-    client = PyLspClient(
-        lsp_timeout=20, workspace="testdata/python2", initfile="main.py"
-    )
-    client.init()
-    res = client.generic_textdoc("documentSymbol")
-    pprint(res)
-    print("*" * 78)
-    pprint(flatten_symbols(res))
-    print("*" * 78)
-    res = client.generic_textdoc("definition", pos=(0, 6))
-    print(res)
-    client.shutdown()
-except Exception as e:
-    print(f"WTF {e=}")
-    stdout, stderr = client.srvproc.communicate()
-    if stdout:
-        print("Finish: LSP process stdout:\n", stdout.decode())
-    if stderr:
-        print("Finish: LSP process stderr:\n", stderr.decode())
-    raise e
+if __name__ == "__main__":
+    try:
+        client = PyLspClient(
+            lsp_timeout=20, workspace="testdata/python2", initfile="main.py"
+        )
+        client.init()
+        res = client.generic_textdoc("documentSymbol")
+        pprint(res)
+        print("*" * 78)
+        pprint(flatten_symbols(res))
+        print("*" * 78)
+        res = client.generic_textdoc("definition", pos=(0, 6))
+        print(res)
+        client.shutdown()
+    except Exception as e:
+        print(f"WTF {e=}")
+        stdout, stderr = client.srvproc.communicate()
+        if stdout:
+            print("Finish: LSP process stdout:\n", stdout.decode())
+        if stderr:
+            print("Finish: LSP process stderr:\n", stderr.decode())
+        raise e
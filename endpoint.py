@@ -0,0 +1,80 @@
+import threading
+
+from pylspclient import LspEndpoint  # type: ignore
+from pylspclient.lsp_errors import ResponseError  # type: ignore
+
+from utils import SERVER_RESTARTED
+
+
+class ThreadSafeLspEndpoint(LspEndpoint):
+    """LspEndpoint that can be called from several threads at once.
+
+    The upstream call_method allocates ids without a lock, and leaks the
+    condition when sending fails. Responses arriving after their request
+    timed out are dropped instead of killing the reader thread. Requests on
+    a stopped endpoint fail with SERVER_RESTARTED instead of returning None,
+    and writes to a closed pipe raise BrokenPipeError.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._id_lock = threading.Lock()
+
+    def call_method(self, method_name, **kwargs):
+        if self.shutdown_flag and method_name != "shutdown":
+            raise ResponseError(SERVER_RESTARTED, "endpoint stopped", None)
+        with self._id_lock:
+            current_id = self.next_id
+            self.next_id += 1
+        cond = threading.Condition()
+        self.event_dict[current_id] = cond
+
+        with cond:
+            try:
+                self.send_message(method_name, kwargs, current_id)
+            except BaseException:
+                self.event_dict.pop(current_id, None)
+                raise
+            if self.shutdown_flag:
+                self.event_dict.pop(current_id, None)
+                # LspClient.shutdown stops the endpoint before asking, and
+                # does not wait for the answer
+                if method_name == "shutdown":
+                    return None
+                raise ResponseError(SERVER_RESTARTED, "endpoint stopped", None)
+            if not cond.wait_for(
+                lambda: current_id in self.response_dict, timeout=self._timeout
+            ):
+                self.event_dict.pop(current_id, None)
+                # restart_lsp may have stored an error for it meanwhile
+                self.response_dict.pop(current_id, None)
+                raise TimeoutError()
+
+        self.event_dict.pop(current_id, None)
+        result, error = self.response_dict.pop(current_id)
+        if error:
+            raise ResponseError(
+                error.get("code"), error.get("message"), error.get("data")
+            )
+        return result
+
+    def handle_result(self, rpc_id, result, error):
+        cond = self.event_dict.get(rpc_id)
+        if cond is None:
+            # late response to a request that timed out
+            return
+        with cond:
+            # call_method drops the condition under the lock when timing out
+            if self.event_dict.get(rpc_id) is not cond:
+                return
+            self.response_dict[rpc_id] = (result, error)
+            cond.notify()
+
+    def send_message(self, method_name, params, id=None):
+        try:
+            super().send_message(method_name, params, id)
+        except ValueError:
+            # restart_lsp closed the pipe of the old server
+            if not self.json_rpc_endpoint.stdin.closed:
+                raise
+            raise BrokenPipeError("pipe to the server is closed")
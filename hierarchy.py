@@ -0,0 +1,167 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+
+from utils import to_path
+
+# direction -> (method, key of the neighbour item in each result entry)
+DIRECTIONS: dict[str, tuple[str, Optional[str]]] = {
+    "incoming": ("callHierarchy/incomingCalls", "from"),
+    "outgoing": ("callHierarchy/outgoingCalls", "to"),
+    "supertypes": ("typeHierarchy/supertypes", None),
+    "subtypes": ("typeHierarchy/subtypes", None),
+}
+
+NodeKey = tuple[str, int, int, str]
+
+
+def node_key(item: dict) -> NodeKey:
+    start = item["selectionRange"]["start"]
+    return item["uri"], start["line"], start["character"], item["name"]
+
+
+@dataclass(slots=True)
+class HierarchyNode:
+    name: str
+    kind: int
+    path: str
+    line: int
+    character: int
+    depth: int
+
+
+@dataclass
+class HierarchyGraph:
+    """Nodes reached from the roots, in BFS order. An edge (i, j) means node i
+    calls node j for call hierarchies, or i is a subtype of j for type
+    hierarchies, whatever the direction of the traversal."""
+
+    direction: str
+    nodes: list[HierarchyNode] = field(default_factory=list)
+    edges: list[tuple[int, int]] = field(default_factory=list)
+    # stopped at max_nodes, some edges of the last level are missing
+    truncated: bool = False
+    # nodes whose expansion failed (e.g. timed out), their neighbours are missing
+    failed: list[int] = field(default_factory=list)
+
+    def neighbors(self, i: int) -> list[int]:
+        if self.direction in ("incoming", "subtypes"):
+            return [a for a, b in self.edges if b == i]
+        return [b for a, b in self.edges if a == i]
+
+
+class HierarchyTraverser:
+    """BFS over call and type hierarchies of a PyLspClient.
+
+    Each BFS level is expanded in parallel on `workers` threads. Nodes are
+    identified by uri, selection start and name, so cycles are visited once.
+    Expansions are memoized per traverser, so repeated or overlapping
+    traversals only ask the server about nodes they have not seen.
+    """
+
+    def __init__(self, client, workers: int = 8):
+        self.client = client
+        self.workers = workers
+        self._memo: dict[tuple[str, NodeKey], list[dict]] = {}
+        self.logger = logging.getLogger("PyLspClient")
+
+    def prepare(self, filepath: Optional[str], pos: tuple[int, int], types: bool):
+        method = "prepareTypeHierarchy" if types else "prepareCallHierarchy"
+        return self.client.generic_textdoc(method, filepath, pos) or []
+
+    def expand(self, item: dict, direction: str) -> list[dict]:
+        memo_key = (direction, node_key(item))
+        if (cached := self._memo.get(memo_key)) is not None:
+            return cached
+        method, neighbour = DIRECTIONS[direction]
+        with self.client._foreground():
+            res = self.client.call_method(method, item=item) or []
+        items = [r[neighbour] for r in res] if neighbour else res
+        self._memo[memo_key] = items
+        return items
+
+    def traverse(
+        self,
+        filepath: Optional[str],
+        pos: tuple[int, int],
+        direction: str = "incoming",
+        max_depth: Optional[int] = None,
+        max_nodes: int = 10000,
+    ) -> HierarchyGraph:
+        if direction not in DIRECTIONS:
+            raise ValueError(f"Invalid direction: {direction}")
+        types = direction in ("supertypes", "subtypes")
+        graph = HierarchyGraph(direction)
+        index: dict[NodeKey, int] = {}
+
+        def add(item: dict, depth: int) -> Optional[int]:
+            key = node_key(item)
+            if key in index:
+                return index[key]
+            if len(graph.nodes) >= max_nodes:
+                graph.truncated = True
+                return None
+            start = item["selectionRange"]["start"]
+            index[key] = len(graph.nodes)
+            graph.nodes.append(
+                HierarchyNode(
+                    item["name"],
+                    item["kind"],
+                    to_path(item["uri"]),
+                    start["line"],
+                    start["character"],
+                    depth,
+                )
+            )
+            return index[key]
+
+        def try_expand(item: dict) -> Optional[list[dict]]:
+            # one failing node must not throw away the rest of the graph
+            try:
+                return self.expand(item, direction)
+            except Exception as e:
+                self.logger.warning(f"{direction} of {item['name']} failed: {e!r}")
+                return None
+
+        roots = self.prepare(filepath, pos, types)
+        frontier = [item for item in roots if add(item, 0) is not None]
+        depth = 0
+        with ThreadPoolExecutor(self.workers) as pool:
+            while frontier and (max_depth is None or depth < max_depth):
+                depth += 1
+                next_frontier = []
+                expanded = pool.map(try_expand, frontier)
+                for item, neighbours in zip(frontier, expanded):
+                    i = index[node_key(item)]
+                    if neighbours is None:
+                        graph.failed.append(i)
+                        continue
+                    for neighbour in neighbours:
+                        is_new = node_key(neighbour) not in index
+                        j = add(neighbour, depth)
+                        if j is None:
+                            continue
+                        if direction in ("incoming", "subtypes"):
+                            graph.edges.append((j, i))
+                        else:
+                            graph.edges.append((i, j))
+                        if is_new:
+                            next_frontier.append(neighbour)
+                frontier = next_frontier
+        return graph
+
+
+def traverse_hierarchy(
+    client,
+    filepath: Optional[str],
+    pos: tuple[int, int],
+    direction: str = "incoming",
+    max_depth: Optional[int] = None,
+    max_nodes: int = 10000,
+    workers: int = 8,
+) -> HierarchyGraph:
+    """One-off HierarchyTraverser(client, workers).traverse(...)"""
+    return HierarchyTraverser(client, workers).traverse(
+        filepath, pos, direction, max_depth, max_nodes
+    )
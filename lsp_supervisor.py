@@ -0,0 +1,117 @@
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+_PAGE_SIZE: int = os.sysconf("SC_PAGE_SIZE")
+_CLK_TCK: int = os.sysconf("SC_CLK_TCK")
+
+
+def read_proc_rss(pid: int) -> Optional[int]:
+    """Resident set size of `pid` in bytes, None if the process is gone"""
+    try:
+        with open(f"/proc/{pid}/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def read_proc_cputime(pid: int) -> Optional[float]:
+    """utime + stime of `pid` in seconds, None if the process is gone"""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # comm may contain spaces and parens, fields resume after the last ')'
+    fields = stat[stat.rindex(")") + 2 :].split()
+    utime, stime = int(fields[11]), int(fields[12])
+    return (utime + stime) / _CLK_TCK
+
+
+class LspSupervisor:
+    """Watches the server process of a PyLspClient and restarts it when it
+    crashes or stays past the resource thresholds.
+
+    RSS and CPU are sampled from /proc every `interval` seconds. A threshold
+    must be exceeded for `grace` consecutive samples before restarting, so
+    that short spikes (e.g. initial indexing) are tolerated.
+    """
+
+    def __init__(
+        self,
+        client,
+        max_rss_mb: Optional[float] = None,
+        max_cpu_percent: Optional[float] = None,
+        interval: float = 5.0,
+        grace: int = 3,
+        max_restarts: Optional[int] = None,
+    ):
+        self.client = client
+        self.max_rss_mb = max_rss_mb
+        self.max_cpu_percent = max_cpu_percent
+        self.interval = interval
+        self.grace = grace
+        self.max_restarts = max_restarts
+        self.restarts = 0
+        self.last_sample: dict[str, float] = {}
+        self.logger = logging.getLogger("PyLspClient")
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="LspSupervisor", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        violations = 0
+        pid, last_cpu, last_time = None, None, None
+        while not self._stop.wait(self.interval):
+            proc = self.client.srvproc
+            if proc.pid != pid:
+                # first round, or the server was restarted under us
+                pid, last_cpu, last_time, violations = proc.pid, None, None, 0
+            if proc.poll() is not None:
+                self._restart(f"server exited with code {proc.returncode}")
+                continue
+            rss = read_proc_rss(pid)
+            cpu = read_proc_cputime(pid)
+            now = time.monotonic()
+            if rss is None or cpu is None:
+                continue
+            cpu_percent = 0.0
+            if last_cpu is not None and last_time is not None and now > last_time:
+                cpu_percent = (cpu - last_cpu) / (now - last_time) * 100
+            last_cpu, last_time = cpu, now
+            rss_mb = rss / (1 << 20)
+            self.last_sample = {"rss_mb": rss_mb, "cpu_percent": cpu_percent}
+            self.logger.debug(f"server {pid}: rss={rss_mb:.1f}MB cpu={cpu_percent:.1f}%")
+
+            reasons = []
+            if self.max_rss_mb is not None and rss_mb > self.max_rss_mb:
+                reasons.append(f"rss {rss_mb:.1f}MB > {self.max_rss_mb}MB")
+            if self.max_cpu_percent is not None and cpu_percent > self.max_cpu_percent:
+                reasons.append(f"cpu {cpu_percent:.1f}% > {self.max_cpu_percent}%")
+            violations = violations + 1 if reasons else 0
+            if violations >= self.grace:
+                self._restart(", ".join(reasons))
+
+    def _restart(self, reason: str):
+        if self.max_restarts is not None and self.restarts >= self.max_restarts:
+            self.logger.error(
+                f"not restarting server ({reason}): max_restarts={self.max_restarts} reached"
+            )
+            self._stop.set()
+            return
+        self.restarts += 1
+        try:
+            self.client.restart_lsp(reason)
+        except Exception as e:
+            self.logger.exception(f"failed to restart server: {e}")
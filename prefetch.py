@@ -0,0 +1,67 @@
+import logging
+import queue
+import threading
+from typing import Optional, Sequence
+
+from pylspclient.lsp_errors import ErrorCodes, ResponseError  # type: ignore
+
+
+class Prefetcher:
+    """Fills the client's response cache for documents about to be queried.
+
+    Every enqueued document gets each of `methods` (e.g. "documentSymbol",
+    "semanticTokens/full") requested in the background, so that the later
+    foreground generic_textdoc/semantic_tokens calls are cache hits.
+    Before each request the prefetcher waits for the client to have no
+    foreground request in flight, so prefetching never delays them by more
+    than the one request already sent.
+    """
+
+    def __init__(self, client, methods: Sequence[str]):
+        self.client = client
+        self.methods = list(methods)
+        self.logger = logging.getLogger("PyLspClient")
+        self._queue: queue.Queue[Optional[str]] = queue.Queue()
+        self._seen: set[str] = set()
+        self._seen_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="Prefetcher", daemon=True
+        )
+
+    def start(self):
+        if not self._thread.is_alive():
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._queue.put(None)
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def enqueue(self, filepath: str, force: bool = False):
+        with self._seen_lock:
+            if filepath in self._seen and not force:
+                return
+            self._seen.add(filepath)
+        self._queue.put(filepath)
+
+    def _run(self):
+        while not self._stop.is_set():
+            filepath = self._queue.get()
+            if filepath is None:
+                break
+            for method in list(self.methods):
+                while not self.client.wait_foreground_idle(timeout=0.5):
+                    if self._stop.is_set():
+                        return
+                if self._stop.is_set():
+                    return
+                try:
+                    self.client._textdoc_request(method, filepath)
+                except ResponseError as e:
+                    self.logger.debug(f"prefetch {method} {filepath} failed: {e}")
+                    if e.code == ErrorCodes.MethodNotFound:
+                        self.methods.remove(method)
+                except Exception as e:
+                    self.logger.debug(f"prefetch {method} {filepath} failed: {e}")
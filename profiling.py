@@ -0,0 +1,140 @@
+import cProfile
+import os.path
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Any, Optional
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class SessionProfiler:
+    """Profiles a sequence of PyLspClient calls.
+
+    Three views are collected while started:
+    - wall-clock stack samples of every thread (including the LspEndpoint
+      reader, where responses are JSON decoded) every `interval` seconds,
+      written as collapsed stacks for flamegraph.pl / speedscope
+    - cProfile of the thread that started the profiler, if `use_cprofile`
+    - spans tagged by the client per LSP method or phase, recording wall
+      time, CPU time of the calling thread and time spent waiting for the
+      server
+    """
+
+    def __init__(self, interval: float = 0.005, use_cprofile: bool = True):
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        # tag -> [count, wall, cpu, wait]
+        self.spans: dict[str, list[float]] = defaultdict(
+            lambda: [0, 0.0, 0.0, 0.0]
+        )
+        self.cprofile = cProfile.Profile() if use_cprofile else None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(
+            target=self._sample, name="SessionProfiler", daemon=True
+        )
+        self._start = 0.0
+        self.wall = 0.0
+
+    def start(self):
+        self._start = time.perf_counter()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        self._sampler.start()
+
+    def stop(self):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        self._stop.set()
+        self._sampler.join()
+        self.wall = time.perf_counter() - self._start
+
+    def _sample(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                if tid not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(tid, str(tid)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    @contextmanager
+    def span(self, tag: str):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+            with self._lock:
+                stats = self.spans[tag]
+                stats[0] += 1
+                stats[1] += wall
+                stats[2] += cpu
+
+    @contextmanager
+    def wait(self, tag: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.spans[tag][3] += time.perf_counter() - t
+
+    def breakdown(self) -> dict[str, dict[str, float]]:
+        return {
+            tag: {"count": count, "wall": wall, "cpu": cpu, "wait": wait}
+            for tag, (count, wall, cpu, wait) in sorted(
+                self.spans.items(), key=lambda kv: -kv[1][1]
+            )
+        }
+
+    def format_breakdown(self) -> str:
+        lines = [
+            f"profiled {self.wall:.3f}s, {sum(self.samples.values())} samples",
+            f"{'span':<40} {'count':>6} {'wall':>9} {'cpu':>9} {'wait':>9}",
+        ]
+        for tag, s in self.breakdown().items():
+            lines.append(
+                f"{tag:<40} {s['count']:>6} {s['wall']:>9.3f} "
+                f"{s['cpu']:>9.3f} {s['wait']:>9.3f}"
+            )
+        return "\n".join(lines)
+
+    def write(self, outdir: str) -> dict[str, Any]:
+        """Writes stacks.collapsed, phases.txt and (with cProfile)
+        calls.pstats to `outdir`"""
+        os.makedirs(outdir, exist_ok=True)
+        with open(os.path.join(outdir, "stacks.collapsed"), "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(os.path.join(outdir, "phases.txt"), "w") as f:
+            f.write(self.format_breakdown() + "\n")
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(os.path.join(outdir, "calls.pstats"))
+        return {"outdir": outdir, "wall": self.wall, "spans": self.breakdown()}
+
+
+@contextmanager
+def maybe_span(profiler: Optional[SessionProfiler], tag: str, wait: bool = False):
+    if profiler is None:
+        yield
+    elif wait:
+        with profiler.wait(tag):
+            yield
+    else:
+        with profiler.span(tag):
+            yield
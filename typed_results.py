@@ -0,0 +1,196 @@
+"""Compact, opt-in result types for PyLspClient(typed_results=True).
+
+Location-like results (definition, references, ...) are converted once into
+a LocationList, which keeps all ranges in one flat array of ints and every
+distinct uri once. Position/Range/Location objects are only built when an
+element is accessed.
+"""
+
+from array import array
+from typing import Any, Iterator, overload
+
+
+class Position:
+    __slots__ = ("line", "character")
+
+    def __init__(self, line: int, character: int):
+        self.line = line
+        self.character = character
+
+    def __repr__(self):
+        return f"Position({self.line}, {self.character})"
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Position)
+            and self.line == other.line
+            and self.character == other.character
+        )
+
+    def __hash__(self):
+        return hash((self.line, self.character))
+
+    def to_dict(self) -> dict[str, int]:
+        return {"line": self.line, "character": self.character}
+
+
+class Range:
+    __slots__ = ("start", "end")
+
+    def __init__(self, start: Position, end: Position):
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return f"Range({self.start!r}, {self.end!r})"
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Range)
+            and self.start == other.start
+            and self.end == other.end
+        )
+
+    def __hash__(self):
+        return hash((self.start, self.end))
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"start": self.start.to_dict(), "end": self.end.to_dict()}
+
+
+class Location:
+    __slots__ = ("uri", "range")
+
+    def __init__(self, uri: str, range: Range):
+        self.uri = uri
+        self.range = range
+
+    def __repr__(self):
+        return f"Location({self.uri!r}, {self.range!r})"
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Location)
+            and self.uri == other.uri
+            and self.range == other.range
+        )
+
+    def __hash__(self):
+        return hash((self.uri, self.range))
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"uri": self.uri, "range": self.range.to_dict()}
+
+
+class LocationList:
+    """Struct-of-arrays list of Locations.
+
+    `coords` holds start line, start character, end line, end character of
+    every location, `uri_ids` indexes into `uris`.
+    """
+
+    __slots__ = ("uris", "uri_ids", "coords")
+
+    def __init__(self, uris: list[str], uri_ids: array, coords: array):
+        self.uris = uris
+        self.uri_ids = uri_ids
+        self.coords = coords
+
+    @classmethod
+    def from_dicts(
+        cls, locations: list[dict], uri_key: str = "uri", range_key: str = "range"
+    ) -> "LocationList":
+        uris: list[str] = []
+        uri_index: dict[str, int] = {}
+        uri_ids = array("I")
+        coords = array("I")
+        for loc in locations:
+            uri = loc[uri_key]
+            if (i := uri_index.get(uri)) is None:
+                i = uri_index[uri] = len(uris)
+                uris.append(uri)
+            uri_ids.append(i)
+            start, end = loc[range_key]["start"], loc[range_key]["end"]
+            coords.extend(
+                (start["line"], start["character"], end["line"], end["character"])
+            )
+        return cls(uris, uri_ids, coords)
+
+    def __len__(self) -> int:
+        return len(self.uri_ids)
+
+    @overload
+    def __getitem__(self, i: int) -> Location: ...
+
+    @overload
+    def __getitem__(self, i: slice) -> "LocationList": ...
+
+    def __getitem__(self, i):
+        n = len(self)
+        if isinstance(i, slice):
+            start, stop, step = i.indices(n)
+            ids = range(start, stop, step)
+            uris: list[str] = []
+            uri_index: dict[int, int] = {}
+            uri_ids = array("I")
+            for j in ids:
+                old_id = self.uri_ids[j]
+                if (new_id := uri_index.get(old_id)) is None:
+                    new_id = uri_index[old_id] = len(uris)
+                    uris.append(self.uris[old_id])
+                uri_ids.append(new_id)
+            if step == 1:
+                coords = self.coords[4 * start : 4 * max(start, stop)]
+            else:
+                coords = array("I")
+                for j in ids:
+                    coords.extend(self.coords[4 * j : 4 * j + 4])
+            return LocationList(uris, uri_ids, coords)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("LocationList index out of range")
+        sl, sc, el, ec = self.coords[4 * i : 4 * i + 4]
+        return Location(
+            self.uris[self.uri_ids[i]], Range(Position(sl, sc), Position(el, ec))
+        )
+
+    def __iter__(self) -> Iterator[Location]:
+        return (self[i] for i in range(len(self)))
+
+    def __eq__(self, other):
+        if not isinstance(other, LocationList) or self.coords != other.coords:
+            return False
+        if self.uris == other.uris:
+            return self.uri_ids == other.uri_ids
+        # same locations, uris numbered differently (e.g. a slice)
+        return all(
+            self.uris[a] == other.uris[b] for a, b in zip(self.uri_ids, other.uri_ids)
+        )
+
+    def __repr__(self):
+        return f"LocationList({len(self)} locations in {len(self.uris)} files)"
+
+    def uri(self, i: int) -> str:
+        return self.uris[self.uri_ids[i]]
+
+    def start(self, i: int) -> tuple[int, int]:
+        return self.coords[4 * i], self.coords[4 * i + 1]
+
+    def to_dicts(self) -> list[dict[str, Any]]:
+        return [loc.to_dict() for loc in self]
+
+
+def to_typed(res: Any) -> Any:
+    """Convert Location / Location[] / LocationLink[] results, anything else is
+    returned as is"""
+    if isinstance(res, dict) and "uri" in res and "range" in res:
+        return LocationList.from_dicts([res])[0]
+    if not isinstance(res, list) or not res or not isinstance(res[0], dict):
+        return res
+    first: dict = res[0]
+    if "uri" in first and "range" in first:
+        return LocationList.from_dicts(res)
+    if "targetUri" in first and "targetSelectionRange" in first:
+        return LocationList.from_dicts(res, "targetUri", "targetSelectionRange")
+    return res
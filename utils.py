@@ -1,10 +1,11 @@
 import csv
 import json
 import os.path
+import threading
 from collections import defaultdict
 from dataclasses import fields, is_dataclass
 from pprint import pprint
-from typing import Any, Callable, List, Optional, Type
+from typing import Any, Callable, Hashable, List, Optional, Type
 
 
 def to_uri(path: str, prefix="file://") -> str:
@@ -122,6 +123,20 @@ def dump_semantic_tokens_full(
     return annots
 
 
+# FileChangeType of workspace/didChangeWatchedFiles
+FILE_CREATED, FILE_CHANGED, FILE_DELETED = 1, 2, 3
+
+# source files by language id, opened by open_workspace and watched by
+# WorkspaceWatcher unless told otherwise
+SOURCE_SUFFIXES: dict[str, tuple[str, ...]] = {
+    "python": (".py", ".pyi"),
+    "rust": (".rs",),
+    "c": (".c", ".h"),
+}
+
+# JSON-RPC reserved server error, used to fail requests stranded on a dead server
+SERVER_RESTARTED: int = -32099
+
 file_cache: dict[str, str] = {}
 lines_cache: dict[str, list[str]] = {}
 
@@ -136,6 +151,11 @@ def readfile_whole(path: str) -> str:
     return content
 
 
+def invalidate_file(path: str) -> None:
+    file_cache.pop(path, None)
+    lines_cache.pop(path, None)
+
+
 def readfile_chunk_lc(path, start_lc, end_lc) -> str:
     readfile_whole(path)
     lines = lines_cache[path]
@@ -308,3 +328,63 @@ def filter_semtoks_range(
 def leading_spaces(s: str) -> int:
     """Returns the number of leading spaces in a string."""
     return len(s) - len(s.lstrip(" "))
+
+
+class MemoryCacher:
+    """In-process cacher with the get/set interface PyLspClient expects"""
+
+    def __init__(self):
+        self.data: dict[str, Any] = {}
+
+    def get(self, key: str) -> Any:
+        return self.data.get(key)
+
+    def set(self, key: str, value: Any) -> None:
+        self.data[key] = value
+
+    def delete(self, key: str) -> None:
+        self.data.pop(key, None)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution.
+
+    The first caller of `do(key, fn)` runs fn, callers arriving with the same
+    key while it runs wait for it and get the same result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: dict[Hashable, _Flight] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def inflight(self) -> int:
+        return len(self._flights)
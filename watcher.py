@@ -0,0 +1,108 @@
+import logging
+import os
+import threading
+from typing import Iterable, Optional
+
+from utils import FILE_CHANGED, FILE_CREATED, FILE_DELETED, SOURCE_SUFFIXES
+
+DEFAULT_IGNORE_DIRS: frozenset[str] = frozenset(
+    {"__pycache__", "node_modules", "target", "build", "logs"}
+)
+
+FileStamp = tuple[int, int]
+
+
+def scan_workspace(
+    workspace: str,
+    ignore_dirs: Iterable[str] = DEFAULT_IGNORE_DIRS,
+    suffixes: Optional[tuple[str, ...]] = None,
+) -> dict[str, FileStamp]:
+    """(mtime_ns, size) of every file under `workspace`, skipping hidden and
+    ignored directories"""
+    ignore_dirs = set(ignore_dirs)
+    stamps: dict[str, FileStamp] = {}
+    for root, dirs, files in os.walk(workspace):
+        dirs[:] = [d for d in dirs if not d.startswith(".") and d not in ignore_dirs]
+        for name in files:
+            if suffixes is not None and not name.endswith(suffixes):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stamps[path] = (st.st_mtime_ns, st.st_size)
+    return stamps
+
+
+def diff_stamps(
+    old: dict[str, FileStamp], new: dict[str, FileStamp]
+) -> list[tuple[str, int]]:
+    changes = [(p, FILE_DELETED) for p in old.keys() - new.keys()]
+    for path, stamp in new.items():
+        if path not in old:
+            changes.append((path, FILE_CREATED))
+        elif old[path] != stamp:
+            changes.append((path, FILE_CHANGED))
+    return changes
+
+
+class WorkspaceWatcher:
+    """Polls the client's workspace for file changes and hands them to
+    PyLspClient.files_changed, which notifies the server and invalidates the
+    caches of the affected files only.
+
+    Stdlib-only: the workspace is re-scanned (stat only) every `interval`
+    seconds, so restrict `suffixes` on very large trees. By default only the
+    source files of the client's language are watched, pass `suffixes=("",)`
+    to watch every file.
+    """
+
+    def __init__(
+        self,
+        client,
+        interval: float = 1.0,
+        ignore_dirs: Iterable[str] = DEFAULT_IGNORE_DIRS,
+        suffixes: Optional[tuple[str, ...]] = None,
+    ):
+        self.client = client
+        self.root = os.path.abspath(client.workspace)
+        self.interval = interval
+        self.ignore_dirs = frozenset(ignore_dirs)
+        if suffixes is None:
+            suffixes = SOURCE_SUFFIXES.get(client.language_id)
+        self.suffixes = suffixes
+        self.logger = logging.getLogger("PyLspClient")
+        self._stamps = self.scan()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="WorkspaceWatcher", daemon=True
+        )
+
+    def scan(self) -> dict[str, FileStamp]:
+        return scan_workspace(self.root, self.ignore_dirs, self.suffixes)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def poll(self) -> list[tuple[str, int]]:
+        """Scan once and propagate the changes since the previous scan"""
+        stamps = self.scan()
+        changes = diff_stamps(self._stamps, stamps)
+        self._stamps = stamps
+        if changes:
+            self.logger.info(f"workspace changes: {changes}")
+            self.client.files_changed(changes)
+        return changes
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                self.logger.exception(f"watcher poll failed: {e}")